@@ -1,42 +1,127 @@
 # ai_agent.py
 import os
+import re
+import sys
+import ast
+import json
+import functools
+import tempfile
+import threading
+from typing import Dict, Tuple
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
 from langchain_openai import ChatOpenAI
 from langchain.schema import HumanMessage, SystemMessage
 from langchain_core.output_parsers import StrOutputParser
 from dotenv import load_dotenv
+from data_loader import compute_schema_hash
 
 # Load environment variables (your API key)
 load_dotenv()
 
+# Serializes read-merge-write of the answer cache file between agents (one per uploaded file)
+_EXACT_CACHE_LOCK = threading.Lock()
+
+# Optional opening ``` / ```python fence, the code itself, optional closing fence
+_FENCE_RE = re.compile(r"^(?:```(?:python)?)?(.*?)(?:```)?$", re.DOTALL)
+
+# pandas' .plot() imports pyplot by itself, so make sure that also gets the headless backend
+os.environ.setdefault("MPLBACKEND", "Agg")
+
+@functools.lru_cache(maxsize=1)
+def _get_plt():
+    """
+    Imports matplotlib.pyplot on first use only; most questions never plot.
+    Uses the non-interactive Agg backend since figures are returned, not shown in a window.
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    return plt
+
+@functools.lru_cache(maxsize=1)
+def get_llm() -> ChatOpenAI:
+    """
+    Returns a shared ChatOpenAI client.
+    Every agent reuses it, so re-uploading files doesn't open a new HTTP connection pool.
+    """
+    # Using gpt-3.5-turbo for cost efficiency
+    return ChatOpenAI(
+        model="gpt-3.5-turbo",
+        temperature=0,  # Set to 0 for deterministic, reliable code generation
+        streaming=True,  # Lets us stop reading as soon as the code is complete
+        openai_api_key=os.getenv("OPENAI_API_KEY")
+    )
+
+def _render_frame(result) -> str:
+    return f"Here are the results:\n\n{result.to_string()}"
+
+def _render_iterable(result) -> str:
+    return f"**Result:** {list(result)}"
+
+def _render_scalar(result) -> str:
+    return f"**Answer:** {result}"
+
+# Exact-type lookup for the result types generated code usually returns
+_RENDERERS = {
+    pd.DataFrame: _render_frame,
+    pd.Series: _render_frame,
+    list: _render_iterable,
+    tuple: _render_iterable,
+    set: _render_iterable,
+    dict: _render_iterable,
+    np.ndarray: _render_iterable,
+    pd.Index: _render_iterable,
+    str: _render_scalar,
+    int: _render_scalar,
+    float: _render_scalar,
+    bool: _render_scalar,
+    np.int64: _render_scalar,
+    np.float64: _render_scalar,
+    np.bool_: _render_scalar
+}
+
+def _render_result(result) -> str:
+    """Formats an execution result for the chat, dispatching on its exact type."""
+    renderer = _RENDERERS.get(type(result))
+    if renderer is None:
+        # Subclasses and less common types fall back to structural checks
+        if isinstance(result, (pd.DataFrame, pd.Series)):
+            renderer = _render_frame
+        elif hasattr(result, '__iter__') and not isinstance(result, str):
+            renderer = _render_iterable
+        else:
+            renderer = _render_scalar
+    return renderer(result)
+
+def _take_open_figure():
+    """
+    Returns the current figure if the executed code drew one, closing every open figure
+    so the next question starts from a clean slate. pyplot is only checked if already imported.
+    """
+    plt = sys.modules.get("matplotlib.pyplot")
+    if plt is None or not plt.get_fignums():
+        return None
+    fig = plt.gcf()
+    plt.close("all")
+    return fig
+
+def _is_execution_error(result) -> bool:
+    """True for the error message execute_code_safely returns (without str()-ing large results)."""
+    return isinstance(result, str) and result.startswith("Error executing code")
+
 class DataAnalysisAgent:
     """
     An AI agent that generates and executes Python code to analyze data.
     Designed for minimal API cost and maximum reliability.
     """
-    def __init__(self, df: pd.DataFrame):
-        """
-        Initialize the agent with the DataFrame it will analyze.
-        """
-        self.df = df
-        # Initialize the LLM - using gpt-3.5-turbo for cost efficiency
-        self.llm = ChatOpenAI(
-            model="gpt-3.5-turbo",
-            temperature=0,  # Set to 0 for deterministic, reliable code generation
-            openai_api_key=os.getenv("OPENAI_API_KEY")
-        )
-        self.output_parser = StrOutputParser()
-
-    def _create_system_prompt(self, context: str) -> str:
-        """
-        Creates a precise system prompt with the retrieved context and strict rules.
-        This is key to minimizing errors and API cost.
-        """
-        return f"""You are a expert Python data analyst. Your task is to generate accurate, efficient pandas code to answer a user's question about a dataset.
+    # System prompt template, split around the retrieved dataset context
+    PROMPT_PREFIX = """You are a expert Python data analyst. Your task is to generate accurate, efficient pandas code to answer a user's question about a dataset.
 
 CONTEXT FROM THE DATASET:
-{context}
+"""
+
+    PROMPT_SUFFIX = """
 
 THE DATAFRAME:
 - The DataFrame is already loaded as `df`.
@@ -71,65 +156,179 @@ plt.show()
 Now, generate clean, accurate code for the following question:
 """
 
+    def __init__(self, df: pd.DataFrame, vector_store=None, cache_path: str = ".agent_cache.json"):
+        """
+        Initialize the agent with the DataFrame it will analyze.
+        If a DataAnalysisVectorStore is given, its semantic cache is used to
+        reuse code generated for similar questions about the same schema.
+        Exact repeats of a question are answered from `cache_path` without any API call.
+        """
+        self.df = df
+        self.vector_store = vector_store
+        self.schema_hash = compute_schema_hash(df)
+        self.cache_path = cache_path
+        self._exact_cache: Dict[Tuple[str, str], str] = self._load_exact_cache()
+        # Names available to generated code; copied (not rebuilt) for every execution
+        self._base_namespace = {'df': df, 'pd': pd}
+        self.llm = get_llm()
+        self.output_parser = StrOutputParser()
+
+    def _create_system_prompt(self, context: str) -> str:
+        """
+        Creates a precise system prompt with the retrieved context and strict rules.
+        This is key to minimizing errors and API cost.
+        """
+        # The context is the only variable part, so it's spliced between two constant strings
+        return self.PROMPT_PREFIX + context + self.PROMPT_SUFFIX
+
     def execute_code_safely(self, code: str):
         """
         Executes the generated Python code in a highly restricted environment.
         Returns the actual result of the computation, not the code itself.
         """
-        # Clean the code first
+        # Clean the code first, then remove markdown code fences if present
         code = code.strip().strip('"').strip("'")
-        
-        # Remove markdown code blocks if present
-        if code.startswith('```python'):
-            code = code[9:]
-        if code.startswith('```'):
-            code = code[3:]
-        if code.endswith('```'):
-            code = code[:-3]
-        code = code.strip()
+        code = _FENCE_RE.match(code).group(1).strip()
         
         # Allow only safe imports and the existing DataFrame
-        allowed_locals = {'df': self.df, 'pd': pd, 'plt': plt}
-        allowed_globals = {}
+        if self._base_namespace['df'] is not self.df:
+            # The agent was pointed at a new DataFrame
+            self._base_namespace['df'] = self.df
+        # Shallow copy, since exec adds the generated code's variables to it
+        namespace = self._base_namespace.copy()
+        # Only pay matplotlib's import cost when the code actually plots
+        if 'plt' in code:
+            namespace['plt'] = _get_plt()
         
         try:
-            # First, try to evaluate it as an expression (e.g., "df['col'].min()")
-            # This will return the actual result
-            result = eval(code, allowed_globals, allowed_locals)
-            return result
+            # Parse the code once and decide how to run it from the syntax tree
+            tree = ast.parse(code, mode="exec")
+            
+            # A single expression (e.g. "df['col'].min()"): evaluate it and return the actual result
+            if len(tree.body) == 1 and isinstance(tree.body[0], ast.Expr):
+                expression = ast.Expression(body=tree.body[0].value)
+                result = eval(compile(expression, "<generated>", "eval"), namespace)
+                return _take_open_figure() or result
+            
+            # Multi-line code: capture the value of a trailing expression in `_result`
+            if tree.body and isinstance(tree.body[-1], ast.Expr):
+                last_node = tree.body[-1]
+                tree.body[-1] = ast.copy_location(
+                    ast.Assign(targets=[ast.Name(id="_result", ctx=ast.Store())], value=last_node.value),
+                    last_node
+                )
+                ast.fix_missing_locations(tree)
+            exec(compile(tree, "<generated>", "exec"), namespace)
+            
+            # Check if a plot was created (also by pandas, e.g. "df.plot()", without `plt` in the code)
+            fig = _take_open_figure()
+            if fig is not None:
+                return fig
+            
+            result = namespace.get('_result')
+            if result is not None:
+                return result
+            
+            # If we can't get a specific result, return success message
+            return "Code executed successfully (no return value)."
             
         except Exception as e:
-            # If eval fails (e.g., for multi-line code or plots), try exec
+            # Don't leave a half-drawn figure around for the next question to draw into
+            _take_open_figure()
+            return f"Error executing code: {str(e)}"
+
+    @staticmethod
+    def _is_code_complete(text: str) -> bool:
+        """
+        Returns True once a streamed completion can't contain any more useful code:
+        a closed markdown fence, or the "need more context" reply.
+        Unfenced code is read to the end, since any statement (a second figure included)
+        may still follow what already parses as a complete program.
+        """
+        if text.lstrip().startswith("```"):
+            return text.count("```") >= 2
+        return "# I need more context" in text and text.endswith("\n")
+
+    def _stream_code(self, messages) -> str:
+        """
+        Streams the completion and stops reading as soon as the code is complete,
+        instead of waiting for the last token of any trailing text.
+        """
+        parts = []
+        for chunk in self.llm.stream(messages):
+            parts.append(chunk.content)
+            # Code can only become complete at the end of a line or a closing fence
+            if ("\n" in chunk.content or "`" in chunk.content) and self._is_code_complete("".join(parts)):
+                break
+        return "".join(parts)
+
+    def _load_exact_cache(self) -> Dict[Tuple[str, str], str]:
+        """
+        Loads the exact-match cache from disk as {(schema_hash, normalized_question): code}.
+        A missing or unreadable file just means starting with an empty cache.
+        """
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return {
+            (schema_hash, question): code
+            for schema_hash, entries in stored.items()
+            for question, code in entries.items()
+        }
+
+    def _save_exact_cache(self) -> None:
+        """
+        Writes the exact-match cache atomically (temp file + rename) so a crash never leaves it half-written.
+        Other agents share the file, so their entries are re-read and merged in first rather than overwritten.
+        """
+        with _EXACT_CACHE_LOCK:
+            self._exact_cache = {**self._load_exact_cache(), **self._exact_cache}
+            stored: Dict[str, Dict[str, str]] = {}
+            for (schema_hash, question), code in self._exact_cache.items():
+                stored.setdefault(schema_hash, {})[question] = code
             try:
-                # For exec, we need to capture the result differently
-                # Create a variable to store the result
-                exec_vars = {}
-                exec_vars.update(allowed_globals)
-                exec_vars.update(allowed_locals)
-                
-                # Execute the code
-                exec(code, exec_vars, exec_vars)
-                
-                # Try to get a result if it's a simple expression
-                try:
-                    # Check if the code was a simple expression
-                    if len(code.split('\n')) == 1 and '=' not in code:
-                        result = eval(code, exec_vars, exec_vars)
-                        return result
-                except:
-                    pass
-                
-                # Check if a plot was created
-                if 'plt' in exec_vars and exec_vars['plt'].get_fignums():
-                    fig = exec_vars['plt'].gcf()
-                    exec_vars['plt'].close()
-                    return fig
-                
-                # If we can't get a specific result, return success message
-                return "Code executed successfully (no return value)."
-                
-            except Exception as exec_error:
-                return f"Error executing code: {str(exec_error)}"
+                cache_dir = os.path.dirname(os.path.abspath(self.cache_path))
+                with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=cache_dir, delete=False) as f:
+                    json.dump(stored, f)
+                os.replace(f.name, self.cache_path)
+            except OSError as e:
+                print(f"   ⚠️ Could not save answer cache: {e}")
+
+    def _exact_cache_key(self, question: str) -> Tuple[str, str]:
+        """Normalizes a question so trivially different repeats share one cache entry."""
+        return (self.schema_hash, question.strip().casefold())
+
+    def _lookup_cached_code(self, question: str):
+        """
+        Returns previously generated code for a semantically similar question, or None on a miss.
+        Cache failures never block answering; they just fall through to the LLM.
+        """
+        if self.vector_store is None:
+            return None
+        try:
+            return self.vector_store.lookup_cached_code(question, self.schema_hash)
+        except Exception as e:
+            print(f"   ⚠️ Semantic cache lookup failed: {e}")
+            return None
+
+    def _cache_generated_code(self, question: str, generated_code: str, execution_result) -> None:
+        """
+        Stores code that produced a usable answer so repeated or paraphrased questions can skip the LLM.
+        """
+        if _is_execution_error(execution_result) or "I need more context" in generated_code:
+            return
+        self._exact_cache[self._exact_cache_key(question)] = generated_code
+        self._save_exact_cache()
+        if self.vector_store is None:
+            return
+        try:
+            self.vector_store.cache_generated_code(
+                question, generated_code, self.schema_hash, str(execution_result)
+            )
+        except Exception as e:
+            print(f"   ⚠️ Could not update semantic cache: {e}")
 
     def generate_answer(self, question: str, context: str) -> str:
         """
@@ -137,38 +336,42 @@ Now, generate clean, accurate code for the following question:
         """
         print(f"🤖 Generating code for: '{question}'")
         
-        # 1. Create the precise prompt
-        system_prompt = self._create_system_prompt(context)
-        messages = [
-            SystemMessage(content=system_prompt),
-            HumanMessage(content=question)
-        ]
-        
-        # 2. Generate code with the LLM
-        generated_code = self.llm.invoke(messages).content
-        # Remove any surrounding quotes
-        generated_code = generated_code.strip().strip('"').strip("'")
+        # 1. Reuse code for a question we've already answered: exact repeats first,
+        #    then semantically similar questions
+        generated_code = self._exact_cache.get(self._exact_cache_key(question))
+        if generated_code is None:
+            generated_code = self._lookup_cached_code(question)
+        from_cache = generated_code is not None
+
+        if not from_cache:
+            # 2. Create the precise prompt and generate code with the LLM
+            system_prompt = self._create_system_prompt(context)
+            messages = [
+                SystemMessage(content=system_prompt),
+                HumanMessage(content=question)
+            ]
+            generated_code = self._stream_code(messages)
+            # Remove any surrounding quotes
+            generated_code = generated_code.strip().strip('"').strip("'")
         print(f"   Generated code:\n{generated_code}")
         
         # 3. Execute the code safely
         execution_result = self.execute_code_safely(generated_code)
         print(f"   Execution result: {str(execution_result)[:100]}...")
+
+        if not from_cache:
+            self._cache_generated_code(question, generated_code, execution_result)
         
         # 4. Format a final answer
-        if "Error executing code" in str(execution_result):
+        if _is_execution_error(execution_result):
             return f"I encountered an error: {execution_result}. Please try rephrasing your question."
         elif "I need more context" in generated_code:
             return "I couldn't find enough information in the data to answer this question. Please try asking about the data that's available."
         else:
             # Handle different types of results intelligently
-            if isinstance(execution_result, (pd.DataFrame, pd.Series)):
-                return f"Here are the results:\n\n{execution_result.to_string()}"
-            elif hasattr(execution_result, '__iter__') and not isinstance(execution_result, str):
-                return f"**Result:** {list(execution_result)}"
-            else:
-                return f"**Answer:** {execution_result}"
+            return _render_result(execution_result)
 
 # Example function to tie everything together
-def create_ai_agent(df: pd.DataFrame):
+def create_ai_agent(df: pd.DataFrame, vector_store=None):
     """Factory function to create a new AI agent instance."""
-    return DataAnalysisAgent(df)
\ No newline at end of file
+    return DataAnalysisAgent(df, vector_store)
\ No newline at end of file
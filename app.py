@@ -3,9 +3,12 @@ import streamlit as st
 import pandas as pd
 from dotenv import load_dotenv
 import os
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
 
 # Import our custom modules
-from data_loader import load_and_profile_csv
+from data_loader import load_and_profile_csv, compute_schema_hash
 from vector_store import DataAnalysisVectorStore
 from ai_agent import DataAnalysisAgent
 
@@ -65,6 +68,19 @@ if 'agent' not in st.session_state:
 if 'messages' not in st.session_state:
     st.session_state.messages = []
 
+# --- CACHED RESOURCES ---
+# Built once per server process instead of on every rerun (each chat message reruns this script)
+@st.cache_resource
+def get_vector_store(api_key: str, usage_tier: Optional[str] = None,
+                     requests_per_minute: Optional[float] = None) -> DataAnalysisVectorStore:
+    return DataAnalysisVectorStore(api_key, openai_usage_tier=usage_tier, requests_per_minute=requests_per_minute)
+
+# Agents hold their uploaded DataFrame, so only the most recent files are kept, each for at most an hour
+@st.cache_resource(max_entries=4, ttl=60 * 60)
+def get_agent(schema_hash: str, file_hash: str, _df: pd.DataFrame, _vector_store: DataAnalysisVectorStore) -> DataAnalysisAgent:
+    # Underscored arguments are not hashed by Streamlit; the two hashes identify the data
+    return DataAnalysisAgent(_df, _vector_store)
+
 # --- SIDEBAR: FILE UPLOAD & PROCESSING ---
 with st.sidebar:
     st.header("📁 Step 1: Upload Data")
@@ -84,19 +100,36 @@ with st.sidebar:
     if process_button and uploaded_file is not None:
         with st.spinner("Analyzing your data structure..."):
             try:
-                # Step 1: Load and profile the CSV
-                df, profile, metadata = load_and_profile_csv(uploaded_file)
-                st.session_state.df = df
-                
-                # Step 2: Create vector store
                 api_key = os.getenv("OPENAI_API_KEY")
-                vector_store = DataAnalysisVectorStore(api_key)
-                vector_store.clear_vectorstore()  # Clear old data
-                vector_store.create_and_persist_vectorstore(profile, metadata)
-                st.session_state.vector_store = vector_store
+                # Embedding requests are paced to OPENAI_REQUESTS_PER_MINUTE if set, else to OPENAI_USAGE_TIER's rate
+                requests_per_minute = os.getenv("OPENAI_REQUESTS_PER_MINUTE")
+                vector_store = get_vector_store(
+                    api_key,
+                    os.getenv("OPENAI_USAGE_TIER"),
+                    float(requests_per_minute) if requests_per_minute else None
+                )
                 
-                # Step 3: Create AI agent
-                st.session_state.agent = DataAnalysisAgent(df)
+                # Independent I/O-bound steps run on a worker thread while this thread
+                # does the next piece of work (Streamlit calls stay on this thread)
+                with ThreadPoolExecutor(max_workers=1) as executor:
+                    # Step 1: Clear old data in the background while we load and profile the CSV
+                    clear_future = executor.submit(vector_store.clear_vectorstore)
+                    df, profile, metadata = load_and_profile_csv(uploaded_file)
+                    st.session_state.df = df
+                    clear_future.result()
+                    
+                    # Step 2: Embed and persist the profile in the background...
+                    persist_future = executor.submit(
+                        vector_store.create_and_persist_vectorstore, profile, metadata
+                    )
+                    
+                    # Step 3: ...while we create the AI agent (shares the vector store for its semantic cache)
+                    file_hash = hashlib.sha256(uploaded_file.getvalue()).hexdigest()
+                    agent = get_agent(compute_schema_hash(df), file_hash, df, vector_store)
+                    persist_future.result()
+                
+                st.session_state.vector_store = vector_store
+                st.session_state.agent = agent
                 
                 st.session_state.messages = []
                 st.success("✅ Data processed and AI agent is ready!")
@@ -1,6 +1,19 @@
 import pandas as pd
+import numpy as np
 import io
-from typing import Tuple, Dict, Any
+import os
+import time
+import pickle
+import hashlib
+import tempfile
+import warnings
+from typing import Tuple, Dict, Any, Optional
+
+# Parsed uploads are cached here so re-uploading an identical file skips parsing and profiling
+PROFILE_CACHE_DIR = ".profile_cache"
+PROFILE_CACHE_TTL_SECONDS = 24 * 60 * 60
+# Bump whenever the profile format changes so stale cached profiles are ignored
+PROFILE_CACHE_VERSION = 4
 
 def load_and_profile_csv(uploaded_file) -> Tuple[pd.DataFrame, str, Dict[str, Any]]:
     """
@@ -25,11 +38,17 @@ def load_and_profile_csv(uploaded_file) -> Tuple[pd.DataFrame, str, Dict[str, An
     if not uploaded_file.name.endswith('.csv'):
         raise ValueError("Please upload a CSV file.")
     
+    # Identical bytes with the same name produce an identical profile, so reuse it if we have one
+    raw_bytes = uploaded_file.getvalue()
+    cache_key = _profile_cache_key(uploaded_file.name, raw_bytes)
+    cached = _load_cached_profile(cache_key)
+    if cached is not None:
+        return cached
+    
     # Read the file into a Pandas DataFrame
-    # Using io.StringIO to convert the uploaded byte stream to a text stream for pandas
+    # Parsing the raw bytes directly avoids holding a decoded copy of the whole file in memory
     try:
-        string_io = io.StringIO(uploaded_file.getvalue().decode("utf-8"))
-        df = pd.read_csv(string_io)
+        df = pd.read_csv(io.BytesIO(raw_bytes))
     except Exception as e:
         raise Exception(f"Error reading the CSV file: {e}")
     
@@ -49,51 +68,146 @@ def load_and_profile_csv(uploaded_file) -> Tuple[pd.DataFrame, str, Dict[str, An
         "column_dtypes": df.dtypes.astype(str).to_dict()
     }
     
+    _save_cached_profile(cache_key, (df, profile, metadata))
     return df, profile, metadata
 
+def _profile_cache_key(file_name: str, raw_bytes: bytes) -> str:
+    """
+    Fingerprints an upload by its name and raw bytes.
+    BLAKE2b is in the standard library and hashes far faster than the CSV can be parsed.
+    """
+    digest = hashlib.blake2b(digest_size=32)
+    digest.update(f"v{PROFILE_CACHE_VERSION}:{file_name}\x00".encode("utf-8"))
+    digest.update(raw_bytes)
+    return digest.hexdigest()
+
+def _load_cached_profile(cache_key: str) -> Optional[Tuple[pd.DataFrame, str, Dict[str, Any]]]:
+    """
+    Returns the cached (df, profile, metadata) for this key, or None if missing, expired or unreadable.
+    Expired and unreadable entries are deleted, since each one holds a whole pickled DataFrame.
+    """
+    cache_path = os.path.join(PROFILE_CACHE_DIR, f"{cache_key}.pkl")
+    if not os.path.exists(cache_path):
+        return None
+    try:
+        if time.time() - os.path.getmtime(cache_path) <= PROFILE_CACHE_TTL_SECONDS:
+            with open(cache_path, "rb") as f:
+                return pickle.load(f)
+    except Exception:
+        pass
+    _remove_quietly(cache_path)
+    return None
+
+def _prune_cached_profiles() -> None:
+    """
+    Deletes every cached profile older than the TTL, including ones never requested again.
+    """
+    cutoff = time.time() - PROFILE_CACHE_TTL_SECONDS
+    with os.scandir(PROFILE_CACHE_DIR) as entries:
+        for entry in entries:
+            if entry.name.endswith(".pkl") and entry.stat().st_mtime < cutoff:
+                _remove_quietly(entry.path)
+
+def _remove_quietly(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def _save_cached_profile(cache_key: str, result: Tuple[pd.DataFrame, str, Dict[str, Any]]) -> None:
+    """
+    Stores a parsed upload atomically (temp file + rename). Caching is best-effort, so failures are ignored.
+    Expired entries are pruned first so the cache directory doesn't grow without bound.
+    """
+    try:
+        os.makedirs(PROFILE_CACHE_DIR, exist_ok=True)
+        _prune_cached_profiles()
+        with tempfile.NamedTemporaryFile("wb", dir=PROFILE_CACHE_DIR, delete=False) as f:
+            pickle.dump(result, f, protocol=5)
+        os.replace(f.name, os.path.join(PROFILE_CACHE_DIR, f"{cache_key}.pkl"))
+    except Exception as e:
+        print(f"   ⚠️ Could not cache data profile: {e}")
+
 def generate_data_profile(df: pd.DataFrame, file_name: str) -> str:
     """
     Generates a detailed English text summary of the DataFrame's structure and content.
     This text will be the core context for the LLM to understand the data.
     """
-    buffer = io.StringIO()
+    # Collect the sections in a list and join once at the end
+    parts = []
     
     # 1. Basic Info
-    buffer.write(f"# PROFILING REPORT FOR: {file_name}\n\n")
-    buffer.write(f"This dataset has **{df.shape[0]} rows** and **{df.shape[1]} columns**.\n\n")
+    parts.append(f"# PROFILING REPORT FOR: {file_name}\n\n")
+    parts.append(f"This dataset has **{df.shape[0]} rows** and **{df.shape[1]} columns**.\n\n")
     
     # 2. Column Names and Data Types
-    buffer.write("## COLUMN SUMMARY\n")
-    for i, col in enumerate(df.columns, 1):
-        dtype = df[col].dtype
-        buffer.write(f"{i}. `{col}` : *{dtype}*\n")
-    buffer.write("\n")
+    parts.append("## COLUMN SUMMARY\n")
+    dtypes = df.dtypes.astype(str).values
+    parts.extend(f"{i}. `{col}` : *{dtype}*\n" for i, (col, dtype) in enumerate(zip(df.columns, dtypes), 1))
+    parts.append("\n")
     
     # 3. Preview of the Data (First 3 rows)
-    buffer.write("## DATA PREVIEW (First 3 rows)\n")
-    # Convert the preview to a markdown-style string for better readability
-    preview_str = df.head(3).to_markdown(index=False)
-    buffer.write(f"{preview_str}\n\n")
+    parts.append("## DATA PREVIEW (First 3 rows, CSV)\n")
+    # CSV is cheap to render (no tabulate) and uses fewer tokens than a markdown table
+    preview_str = df.head(3).to_csv(index=False, lineterminator="\n").rstrip()
+    parts.append(f"{preview_str}\n\n")
     
     # 4. Basic Statistics for Numeric Columns
-    numeric_cols = df.select_dtypes(include=['int64', 'float64']).columns
+    # Match on dtype kind (signed/unsigned int, float) so int32, float32 and nullable
+    # Int64 columns are profiled too, not just int64/float64
+    numeric_cols = df.columns[[dtype.kind in "iuf" for dtype in df.dtypes]]
     if not numeric_cols.empty:
-        buffer.write("## BASIC STATISTICS (Numeric Columns)\n")
-        stats = df[numeric_cols].describe().round(2)
-        stats_str = stats.to_markdown()
-        buffer.write(f"{stats_str}\n\n")
+        parts.append("## BASIC STATISTICS (Numeric Columns)\n")
+        stats = describe_numeric(df[numeric_cols]).round(2)
+        stats_str = stats.to_string()
+        parts.append(f"{stats_str}\n\n")
     else:
-        buffer.write("## BASIC STATISTICS\n*No numeric columns found for statistical analysis.*\n\n")
+        parts.append("## BASIC STATISTICS\n*No numeric columns found for statistical analysis.*\n\n")
     
     # 5. Check for Missing Values
-    buffer.write("## MISSING VALUES\n")
-    missing_values = df.isnull().sum()
-    if missing_values.any():
-        for col, count in missing_values.items():
-            if count > 0:
-                buffer.write(f"- Column `{col}` has **{count}** missing values.\n")
+    parts.append("## MISSING VALUES\n")
+    # One C-level reduction over the null mask instead of per-column Series operations
+    null_counts = df.isna().to_numpy().sum(axis=0)
+    has_nulls = null_counts > 0
+    if has_nulls.any():
+        parts.extend(
+            f"- Column `{col}` has **{count}** missing values.\n"
+            for col, count in zip(df.columns[has_nulls], null_counts[has_nulls])
+        )
     else:
-        buffer.write("*No missing values found in any column.*\n")
+        parts.append("*No missing values found in any column.*\n")
     
     # Return the entire generated profile as a single string
-    return buffer.getvalue()
\ No newline at end of file
+    return "".join(parts)
+
+def describe_numeric(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Computes the same statistics as df.describe() for all-numeric DataFrames.
+    Each statistic is one vectorized NumPy reduction over the 2D float64 view,
+    instead of pandas dispatching every statistic column by column.
+    """
+    values = df.to_numpy(dtype=np.float64, na_value=np.nan)
+    with warnings.catch_warnings():
+        # All-NaN and single-value columns yield NaN, exactly like describe()
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        stats = np.vstack([
+            (~np.isnan(values)).sum(axis=0),
+            np.nanmean(values, axis=0),
+            np.nanstd(values, axis=0, ddof=1),
+            np.nanmin(values, axis=0),
+            np.nanpercentile(values, [25, 50, 75], axis=0),
+            np.nanmax(values, axis=0)
+        ])
+    return pd.DataFrame(
+        stats,
+        index=["count", "mean", "std", "min", "25%", "50%", "75%", "max"],
+        columns=df.columns
+    )
+
+def compute_schema_hash(df: pd.DataFrame) -> str:
+    """
+    Returns a stable fingerprint of the DataFrame's column names and dtypes.
+    Used to scope cached answers to datasets with the same structure.
+    """
+    schema = "|".join(f"{col}:{dtype}" for col, dtype in df.dtypes.astype(str).items())
+    return hashlib.sha256(schema.encode("utf-8")).hexdigest()
\ No newline at end of file
@@ -1,5 +1,6 @@
 # test_ai_agent.py
 import os
+import pathlib
 from dotenv import load_dotenv
 from data_loader import load_and_profile_csv
 from vector_store import DataAnalysisVectorStore
@@ -18,16 +19,14 @@ def test_complete_pipeline():
         
         # 1. Load and profile CSV (Step 1)
         print("1. Loading CSV...")
-        with open(test_file_path, "rb") as f:
-            class MockUploadedFile:
-                def __init__(self, file_path):
-                    self.name = file_path
-                    with open(file_path, 'rb') as file:
-                        self.value = file.read()
-                def getvalue(self):
-                    return self.value
-            uploaded_file = MockUploadedFile(test_file_path)
-            df, profile, metadata = load_and_profile_csv(uploaded_file)
+        class MockUploadedFile:
+            def __init__(self, file_path):
+                self.name = file_path
+                self.value = pathlib.Path(file_path).read_bytes()
+            def getvalue(self):
+                return self.value
+        uploaded_file = MockUploadedFile(test_file_path)
+        df, profile, metadata = load_and_profile_csv(uploaded_file)
         print("   ✅ CSV loaded\n")
 
         # 2. Create vector store (Step 2)
@@ -39,7 +38,7 @@ def test_complete_pipeline():
 
         # 3. Create AI agent (Step 3)
         print("3. Initializing AI agent...")
-        agent = DataAnalysisAgent(df)
+        agent = DataAnalysisAgent(df, vector_store)
         print("   ✅ AI agent ready\n")
 
         # 4. Test questions
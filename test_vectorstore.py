@@ -1,5 +1,6 @@
 # test_vectorstore.py
 import os
+import pathlib
 from dotenv import load_dotenv
 from data_loader import load_and_profile_csv
 from vector_store import DataAnalysisVectorStore
@@ -19,17 +20,15 @@ if __name__ == "__main__":
     try:
         # 1. Simulate file upload and run Step 1 (Data Loading & Profiling)
         print("📂 Step 1: Loading and profiling CSV file...")
-        with open(test_file_path, "rb") as f:
-            class MockUploadedFile:
-                def __init__(self, file_path):
-                    self.name = file_path
-                    with open(file_path, 'rb') as file:
-                        self.value = file.read()
-                def getvalue(self):
-                    return self.value
-                    
-            uploaded_file = MockUploadedFile(test_file_path)
-            df, profile, metadata = load_and_profile_csv(uploaded_file)
+        class MockUploadedFile:
+            def __init__(self, file_path):
+                self.name = file_path
+                self.value = pathlib.Path(file_path).read_bytes()
+            def getvalue(self):
+                return self.value
+                
+        uploaded_file = MockUploadedFile(test_file_path)
+        df, profile, metadata = load_and_profile_csv(uploaded_file)
         print("   ✅ Profiling complete.")
 
         # 2. Initialize the Vector Store class
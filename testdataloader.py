@@ -1,3 +1,6 @@
+import io
+import pathlib
+import pandas as pd
 import streamlit as st
 from data_loader import load_and_profile_csv
 
@@ -7,32 +10,62 @@ if __name__ == "__main__":
     test_file_path = "test.csv"  # <<< CHANGE THIS TO A REAL CSV FILE ON YOUR PC
     
     try:
-        # We use Streamlit's `open` to simulate an uploaded file object
-        with open(test_file_path, "rb") as f:
-            # Create a mock uploaded file object
-            class MockUploadedFile:
-                def __init__(self, file_path):
-                    self.name = file_path
-                    with open(file_path, 'rb') as file:
-                        self.value = file.read()
-                def getvalue(self):
-                    return self.value
-                    
-            uploaded_file = MockUploadedFile(test_file_path)
-            
-            # Test our function
-            df, profile, metadata = load_and_profile_csv(uploaded_file)
-            
-            print("✅ DataFrame loaded successfully!")
-            print(f"📊 Shape: {df.shape}")
-            print("\n--- GENERATED PROFILE ---\n")
-            print(profile)
-            print("\n--- METADATA ---\n")
-            print(metadata)
-            
+        # Create a mock uploaded file object
+        class MockUploadedFile:
+            def __init__(self, file_path):
+                self.name = file_path
+                self.value = pathlib.Path(file_path).read_bytes()
+            def getvalue(self):
+                return self.value
+                
+        uploaded_file = MockUploadedFile(test_file_path)
+        
+        # Test our function
+        df, profile, metadata = load_and_profile_csv(uploaded_file)
+        
+        print("✅ DataFrame loaded successfully!")
+        print(f"📊 Shape: {df.shape}")
+        print("\n--- GENERATED PROFILE ---\n")
+        print(profile)
+        print("\n--- METADATA ---\n")
+        print(metadata)
+        
     except FileNotFoundError:
         print(f"❌ Error: Please create a simple 'test.csv' file in your project folder first.")
         print("   You can create one easily in Excel or with this Python code:")
         print("   import pandas as pd; pd.DataFrame({'A': [1,2,3], 'B': ['x', 'y', 'z']}).to_csv('test.csv', index=False)")
     except Exception as e:
-        print(f"❌ An error occurred: {e}")
\ No newline at end of file
+        print(f"❌ An error occurred: {e}")
+    
+    # Uploads must parse exactly as pandas' default C engine does: missing text cells,
+    # times of day, integers beyond int64 and undecodable bytes all differ under pyarrow
+    print("\n--- PARSER CHECKS ---\n")
+    class MockBytesFile:
+        def __init__(self, name, value):
+            self.name = name
+            self.value = value
+        def getvalue(self):
+            return self.value
+    
+    parser_cases = {
+        "missing_text.csv": b"name,city,price\nA,Paris,1.5\nB,,2.0\nC,NA,\nD,Rome,3\n",
+        "dates_and_times.csv": b"day,at,stamp\n2024-01-02,10:30:00,2024-01-02 10:30:00\n,,\n",
+        "big_ints.csv": b"id\n1\n99999999999999999999\n",
+        "all_na.csv": b"a,b\n1,NA\n2,NA\n",
+    }
+    for name, raw in parser_cases.items():
+        try:
+            df, _, _ = load_and_profile_csv(MockBytesFile(name, raw))
+            pd.testing.assert_frame_equal(df, pd.read_csv(io.BytesIO(raw)))
+            print(f"✅ {name} parsed like the C engine")
+        except Exception as e:
+            print(f"❌ {name}: {e}")
+    
+    missing_city = load_and_profile_csv(MockBytesFile("missing_text.csv", parser_cases["missing_text.csv"]))[0]["city"].isna().sum()
+    print(f"{'✅' if missing_city == 2 else '❌'} Missing cities detected: {missing_city} (expected 2)")
+    
+    try:
+        load_and_profile_csv(MockBytesFile("latin1.csv", "name\ncaf\xe9\n".encode("latin-1")))
+        print("❌ Latin-1 file loaded without a decode error")
+    except Exception as e:
+        print(f"✅ Latin-1 file rejected: {e}")
\ No newline at end of file
@@ -1,100 +1,655 @@
 # vector_store.py
 import os
+import re
+import gc
+import json
+import itertools
 import time
 import shutil
-from typing import List, Dict, Any
+import threading
+import hashlib
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Iterable, Iterator, TypeVar
+import numpy as np
+import openai
+import chromadb
+from chromadb.config import Settings
+from chromadb.api.client import SharedSystemClient
 from langchain_chroma import Chroma
 from langchain_openai import OpenAIEmbeddings
+from langchain.embeddings import CacheBackedEmbeddings
+from langchain.storage import LocalFileStore, EncoderBackedStore
 from langchain.schema import Document
+from langchain.schema.embeddings import Embeddings
+from langchain_core.stores import ByteStore
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 import uuid
 
+T = TypeVar("T")
+
+# Profile sections start with a "## " heading (see data_loader.generate_data_profile)
+_SECTION_BREAK_RE = re.compile(r"\n(?=## )")
+
+def _iter_sections(profile_text: str) -> Iterator[str]:
+    """
+    Yields the profile's sections one at a time, slicing each only when it is needed.
+    Unlike re.split, this never holds a copy of every section at once.
+    """
+    start = 0
+    for match in _SECTION_BREAK_RE.finditer(profile_text):
+        yield profile_text[start:match.start()]
+        start = match.end()
+    yield profile_text[start:]
+
+def _batched(iterable: Iterable[T], size: int) -> Iterator[List[T]]:
+    """Yields lists of up to `size` items, pulling from the iterable lazily."""
+    iterator = iter(iterable)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
+
+@functools.lru_cache(maxsize=2)
+def get_embeddings(openai_api_key: str, max_retries: int = 6) -> OpenAIEmbeddings:
+    """
+    Returns a shared OpenAIEmbeddings client.
+    Every vector store reuses it, so rebuilding the store doesn't open a new HTTP connection pool.
+    Rate-limited stores ask for max_retries=0 and retry through their limiter instead.
+    """
+    return OpenAIEmbeddings(
+        openai_api_key=openai_api_key,
+        chunk_size=1000,  # Max texts per API request
+        max_retries=max_retries,
+        request_timeout=30
+    )
+
+class TokenBucket:
+    """
+    Thread-safe token bucket that lets through at most `requests_per_minute` calls,
+    spaced evenly rather than in bursts.
+    """
+    def __init__(self, requests_per_minute: float):
+        self.rate = requests_per_minute / 60.0  # Tokens added per second
+        self._tokens = 1.0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(1.0, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self) -> None:
+        """
+        Blocks until a request may be sent.
+        """
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return
+                wait_time = (1.0 - self._tokens) / self.rate
+            time.sleep(wait_time)
+
+    def pause(self, seconds: float) -> None:
+        """
+        Holds back every caller for at least `seconds`, e.g. after the API returned a 429.
+        """
+        with self._lock:
+            self._refill()
+            self._tokens = min(self._tokens, 0.0) - seconds * self.rate
+
+@functools.lru_cache(maxsize=None)
+def get_rate_limiter(requests_per_minute: float) -> TokenBucket:
+    """
+    Returns the limiter for a given rate, shared by every vector store in the process,
+    since OpenAI enforces the limit per account rather than per client.
+    """
+    return TokenBucket(requests_per_minute)
+
+def _retry_after_seconds(error: openai.RateLimitError, default: float) -> float:
+    """
+    Reads how long OpenAI asked us to wait from a 429 response's headers.
+    """
+    headers = error.response.headers
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        return float(headers["retry-after"])
+    except (KeyError, ValueError):
+        return default
+
+class RateLimitedEmbeddings(Embeddings):
+    """
+    Paces calls to the underlying embeddings through a TokenBucket.
+    The underlying client must not retry by itself (max_retries=0), so that every attempt,
+    including retries, is paced. On a 429, every worker waits out the Retry-After delay.
+    """
+    MAX_RETRIES = 6
+
+    def __init__(self, underlying_embeddings: Embeddings, limiter: TokenBucket):
+        self.underlying_embeddings = underlying_embeddings
+        self.limiter = limiter
+
+    def _call(self, func, *args):
+        for attempt in itertools.count():
+            self.limiter.acquire()
+            try:
+                return func(*args)
+            except openai.RateLimitError as e:
+                if attempt >= self.MAX_RETRIES:
+                    raise
+                wait_time = _retry_after_seconds(e, default=1.0 / self.limiter.rate)
+                print(f"   ⏳ Rate limited by OpenAI. Waiting {wait_time:.1f}s...")
+                self.limiter.pause(wait_time)
+            except (openai.APIConnectionError, openai.InternalServerError):
+                # Transient failures the client would otherwise have retried; the next attempt is paced too
+                if attempt >= self.MAX_RETRIES:
+                    raise
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._call(self.underlying_embeddings.embed_documents, texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._call(self.underlying_embeddings.embed_query, text)
+
+class QueryCachedEmbeddings(CacheBackedEmbeddings):
+    """
+    CacheBackedEmbeddings that also serves queries from the on-disk cache.
+    Each question is embedded by both the retriever and the semantic cache lookup, and
+    questions stored in qa_cache are already in the cache, so most queries skip the API.
+    """
+    @classmethod
+    def from_float16_store(cls, underlying_embeddings: Embeddings, document_embedding_cache: ByteStore,
+                           namespace: str) -> "QueryCachedEmbeddings":
+        """
+        Like from_bytes_store, but stores each vector as raw float16 instead of JSON text,
+        roughly a tenth of the size on disk. The rounding is far below what changes a
+        cosine similarity in practice.
+        """
+        # Own key prefix, so entries written by from_bytes_store are never read as float16
+        prefix = f"{namespace}-f16-"
+        store = EncoderBackedStore(
+            document_embedding_cache,
+            lambda text: prefix + hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest(),
+            lambda vector: np.asarray(vector, dtype=np.float16).tobytes(),
+            lambda data: np.frombuffer(data, dtype=np.float16).astype(np.float32).tolist()
+        )
+        return cls(underlying_embeddings, store)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
+
 class DataAnalysisVectorStore:
     """
     A class to handle the creation and management of a vector store for the data profile.
     """
-    def __init__(self, openai_api_key: str):
+    # Minimum cosine similarity for a previously asked question to count as a cache hit
+    SEMANTIC_CACHE_THRESHOLD = 0.95
+
+    # Chunks are embedded in sub-batches of this size, with up to this many requests in flight
+    EMBEDDING_BATCH_SIZE = 256
+    EMBEDDING_MAX_WORKERS = 8
+
+    # The splitter is stateless, so one instance is shared instead of rebuilding it per profile
+    _TEXT_SPLITTER = RecursiveCharacterTextSplitter(
+        chunk_size=1000,  # Number of characters per chunk
+        chunk_overlap=200,  # Overlap between chunks to maintain context
+        # Plain `len`: the splitter keeps a reference to it, so there is no name lookup per call,
+        # and the builtin is faster than str.__len__ or any token counter
+        length_function=len,
+    )
+
+    # Chunks shorter than this are merged into a neighbour, as long as the result stays within the max
+    MIN_CHUNK_SIZE = 200
+    MAX_MERGED_CHUNK_SIZE = 1150
+
+    # Profile chunks live in this collection and are inserted this many rows per add() call,
+    # which amortizes Chroma's per-call SQLite transaction overhead
+    PROFILE_COLLECTION = "profile"
+    CHROMA_ADD_BATCH_SIZE = 200
+
+    # With use_async_batch, profiles with at least this many new chunks go through OpenAI's
+    # Batch API (half price, higher rate limit, up to 24h), whose status is polled this often
+    ASYNC_BATCH_MIN_CHUNKS = 50_000
+    ASYNC_BATCH_POLL_INTERVAL = 30
+    # OpenAI caps an embeddings batch at this many inputs across all of its requests
+    ASYNC_BATCH_MAX_INPUTS = 50_000
+
+    # Embedding requests per minute to pace to at each OpenAI usage tier. Limits only grow with
+    # the tier, so tiers 3-5 reuse tier 2's rate as a safe floor; pass requests_per_minute
+    # to use an account's actual limit instead.
+    OPENAI_TIER_REQUESTS_PER_MINUTE = {
+        "tier1": 35,
+        "tier2": 60,
+        "tier3": 60,
+        "tier4": 60,
+        "tier5": 60,
+    }
+
+    def __init__(self, openai_api_key: str, openai_usage_tier: Optional[str] = None,
+                 requests_per_minute: Optional[float] = None):
         """
         Initialize the vector store with OpenAI embeddings and a local ChromaDB persistence directory.
+        If an OpenAI usage tier (or an explicit requests_per_minute) is given, embedding
+        requests are paced to that limit; otherwise they are sent as fast as the workers allow.
         """
+        self.openai_api_key = openai_api_key
+        
+        if requests_per_minute is None and openai_usage_tier is not None:
+            if openai_usage_tier not in self.OPENAI_TIER_REQUESTS_PER_MINUTE:
+                raise ValueError(
+                    f"Unknown OpenAI usage tier '{openai_usage_tier}'. "
+                    f"Expected one of: {', '.join(self.OPENAI_TIER_REQUESTS_PER_MINUTE)}"
+                )
+            requests_per_minute = self.OPENAI_TIER_REQUESTS_PER_MINUTE[openai_usage_tier]
+        
         # Initialize the embedding function
-        self.embeddings = OpenAIEmbeddings(openai_api_key=openai_api_key)
+        self.embeddings = get_embeddings(openai_api_key, max_retries=6 if requests_per_minute is None else 0)
+        underlying_embeddings = self.embeddings
+        if requests_per_minute is not None:
+            underlying_embeddings = RateLimitedEmbeddings(self.embeddings, get_rate_limiter(requests_per_minute))
+        
+        # Document and query embeddings are cached on disk per (model, text), so only new
+        # chunks and questions ever reach the API
+        self.cached_embeddings = QueryCachedEmbeddings.from_float16_store(
+            underlying_embeddings,
+            LocalFileStore(".emb_cache"),
+            namespace=self.embeddings.model
+        )
         
         # Define the path for the database. It will be created inside a 'chroma_db' folder.
         self.persist_directory = "chroma_db"
         
+        # Answered questions live in their own database, so clearing the profile store on
+        # every upload keeps them (they are filtered by schema hash instead)
+        self.qa_cache_directory = "qa_cache_db"
+        
+        # Raw ChromaDB clients for the profile and qa_cache databases
+        self.client = None
+        self.qa_client = None
+
         # This will be our LangChain Chroma client object
         self.vectorstore = None
 
-    def _chunk_profile_text(self, profile_text: str, metadata: Dict[str, Any]) -> List[Document]:
+        # Second collection mapping previously asked questions to their generated code
+        self.qa_cache = None
+
+    @staticmethod
+    def _persistent_client(path: str) -> chromadb.ClientAPI:
+        return chromadb.PersistentClient(
+            path=path,
+            # Skip the telemetry event Chroma otherwise sends on client start and on every query
+            settings=Settings(anonymized_telemetry=False)
+        )
+
+    def _get_client(self) -> chromadb.ClientAPI:
+        """
+        Returns the persistent ChromaDB client for the profile, creating it on first use.
+        """
+        if self.client is None:
+            self.client = self._persistent_client(self.persist_directory)
+        return self.client
+
+    def _get_qa_client(self) -> chromadb.ClientAPI:
+        """
+        Returns the persistent ChromaDB client for the qa_cache, creating it on first use.
+        """
+        if self.qa_client is None:
+            self.qa_client = self._persistent_client(self.qa_cache_directory)
+        return self.qa_client
+
+    def _open_collection(self, collection_name: str, collection_metadata: Optional[Dict[str, Any]] = None,
+                         client: Optional[chromadb.ClientAPI] = None) -> Chroma:
+        """
+        Wraps a collection in LangChain's Chroma, creating it if needed.
+        Uses the profile client unless another one is given.
+        """
+        return Chroma(
+            client=client or self._get_client(),
+            collection_name=collection_name,
+            embedding_function=self.cached_embeddings,
+            collection_metadata=collection_metadata
+        )
+
+    def _chunk_profile_text(self, profile_text: str, metadata: Dict[str, Any]) -> Iterator[Document]:
         """
         Splits the large profile text into smaller, meaningful chunks for better retrieval.
         Uses LangChain's RecursiveTextSplitter for smart splitting.
+        Chunks are yielded one profile section at a time, so callers can start embedding
+        early chunks while later sections are still being split.
         """
-        # Initialize the text splitter
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,  # Number of characters per chunk
-            chunk_overlap=200,  # Overlap between chunks to maintain context
-            length_function=len,
+        # Split each section into chunks, then fold tiny fragments into their neighbours
+        chunks = (
+            chunk
+            for section in _iter_sections(profile_text)
+            for chunk in self._TEXT_SPLITTER.create_documents([section], metadatas=[metadata])
         )
+        return self._merge_small_chunks(chunks)
+
+    @staticmethod
+    def _join_overlapping(first: str, second: str) -> str:
+        """
+        Concatenates two consecutive chunks, dropping the text the splitter repeated as overlap.
+        """
+        for size in range(min(len(first), len(second)), 0, -1):
+            if first.endswith(second[:size]):
+                return first + second[size:]
+        return first + "\n" + second
+
+    def _merge_small_chunks(self, chunks: Iterable[Document]) -> Iterator[Document]:
+        """
+        Greedily merges chunks shorter than MIN_CHUNK_SIZE with their neighbour.
+        Every tiny fragment would otherwise cost its own embedding and a retrieval slot.
+        Merges never exceed MAX_MERGED_CHUNK_SIZE, so no chunk needs re-splitting afterwards.
+        Works on a stream: each chunk is yielded as soon as its successor is known.
+        """
+        previous = None
+        for chunk in chunks:
+            if previous is not None:
+                if len(previous.page_content) < self.MIN_CHUNK_SIZE or len(chunk.page_content) < self.MIN_CHUNK_SIZE:
+                    combined = self._join_overlapping(previous.page_content, chunk.page_content)
+                    if len(combined) <= self.MAX_MERGED_CHUNK_SIZE:
+                        previous.page_content = combined
+                        continue
+                yield previous
+            previous = chunk
+        if previous is not None:
+            yield previous
+
+    @staticmethod
+    def _chunk_id(chunk: Document) -> str:
+        """
+        Derives a deterministic id from a chunk's metadata and content.
+        BLAKE2b is fast and, unlike uuid4, needs no urandom call per chunk.
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(json.dumps(chunk.metadata, sort_keys=True, default=str).encode("utf-8"))
+        digest.update(b"\x00")
+        digest.update(chunk.page_content.encode("utf-8"))
+        return digest.hexdigest()
+
+    def _upsert_embeddings(self, collection, ids: List[str], texts: List[str],
+                           metadatas: List[Dict[str, Any]], embeddings: List[List[float]]) -> None:
+        """
+        Writes precomputed embeddings straight into the collection, CHROMA_ADD_BATCH_SIZE rows at a time.
+        """
+        for start in range(0, len(ids), self.CHROMA_ADD_BATCH_SIZE):
+            end = start + self.CHROMA_ADD_BATCH_SIZE
+            collection.upsert(
+                ids=ids[start:end],
+                documents=texts[start:end],
+                metadatas=metadatas[start:end],
+                embeddings=embeddings[start:end]
+            )
+
+    def _embed_with_batch_api(self, texts: List[str], executor: ThreadPoolExecutor) -> List[List[float]]:
+        """
+        Embeds the texts through OpenAI's Batch API: half the price and a much higher rate limit,
+        but results can take up to 24 hours. Blocks, polling every ASYNC_BATCH_POLL_INTERVAL seconds.
+        Texts are spread over as many batch jobs as the per-batch input limit requires.
+        Any requests the jobs couldn't complete are embedded through the regular path on `executor`.
+        """
+        client = openai.OpenAI(api_key=self.openai_api_key)
+        body = {"model": self.embeddings.model}
+        if self.embeddings.dimensions is not None:
+            body["dimensions"] = self.embeddings.dimensions
         
-        # Create a LangChain Document from the profile text
-        doc = Document(page_content=profile_text, metadata=metadata)
+        # Each job holds up to ASYNC_BATCH_MAX_INPUTS texts, sent as one request per
+        # EMBEDDING_BATCH_SIZE texts; `requests` maps a request's custom_id to its text indices
+        jobs = []
+        for job_indices in _batched(range(len(texts)), self.ASYNC_BATCH_MAX_INPUTS):
+            requests = list(_batched(job_indices, self.EMBEDDING_BATCH_SIZE))
+            input_lines = (
+                json.dumps({
+                    "custom_id": str(request_index),
+                    "method": "POST",
+                    "url": "/v1/embeddings",
+                    "body": {**body, "input": [texts[i] for i in text_indices]}
+                })
+                for request_index, text_indices in enumerate(requests)
+            )
+            input_file = client.files.create(
+                file=("profile_chunks.jsonl", "\n".join(input_lines).encode("utf-8")),
+                purpose="batch"
+            )
+            batch = client.batches.create(
+                input_file_id=input_file.id,
+                endpoint="/v1/embeddings",
+                completion_window="24h"
+            )
+            jobs.append((batch, requests))
+        print(f"   📤 Submitted {len(texts)} chunks to the OpenAI Batch API in {len(jobs)} job(s).")
         
-        # Split the document into chunks
-        chunks = text_splitter.split_documents([doc])
+        # The jobs run concurrently on OpenAI's side, so waiting for them one by one is fine
+        embeddings: List[Optional[List[float]]] = [None] * len(texts)
+        for batch, requests in jobs:
+            while batch.status not in ("completed", "failed", "expired", "cancelled"):
+                time.sleep(self.ASYNC_BATCH_POLL_INTERVAL)
+                batch = client.batches.retrieve(batch.id)
+                print(f"   ⏳ Batch {batch.id}: {batch.status}")
+            if batch.status != "completed":
+                print(f"   ⚠️ Batch {batch.id} ended '{batch.status}'.")
+            if batch.output_file_id:
+                for line in client.files.content(batch.output_file_id).text.splitlines():
+                    result = json.loads(line)
+                    response = result.get("response") or {}
+                    if response.get("status_code") != 200:
+                        continue
+                    text_indices = requests[int(result["custom_id"])]
+                    for item in response["body"]["data"]:
+                        embeddings[text_indices[item["index"]]] = item["embedding"]
         
-        return chunks
+        # Failed, expired or missing requests fall back to the regular (cached) path,
+        # EMBEDDING_BATCH_SIZE texts per call on the worker threads
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            print(f"   ⚠️ {len(missing)} chunk(s) missing from the batch results. Embedding them directly.")
+            fallback = [
+                (indices, executor.submit(self.cached_embeddings.embed_documents, [texts[i] for i in indices]))
+                for indices in _batched(missing, self.EMBEDDING_BATCH_SIZE)
+            ]
+            for indices, future in fallback:
+                for i, embedding in zip(indices, future.result()):
+                    embeddings[i] = embedding
+        return embeddings
 
-    def create_and_persist_vectorstore(self, profile_text: str, metadata: Dict[str, Any]) -> None:
+    def create_and_persist_vectorstore(self, profile_text: str, metadata: Dict[str, Any],
+                                       use_async_batch: bool = False) -> None:
         """
         Main function to create the vector store from the profile text and save it to disk.
+        Chunking and embedding are pipelined: each batch of chunks is sent off for embedding
+        as soon as it is ready, while the rest of the profile is still being split.
+        With use_async_batch, profiles with at least ASYNC_BATCH_MIN_CHUNKS new chunks are
+        embedded through OpenAI's Batch API instead, which can take hours; smaller ones
+        still take the regular path.
         """
         print("🧠 Creating vector store from data profile...")
         
-        # 1. Split the large profile text into chunks
-        chunks = self._chunk_profile_text(profile_text, metadata)
-        print(f"   Created {len(chunks)} text chunks for vectorization.")
+        # 1. FILTER METADATA: Every chunk shares this dict, so drop the values ChromaDB can't
+        #    store (anything but str, int, float, bool) once, before splitting.
+        metadata = {key: value for key, value in metadata.items() if isinstance(value, (str, int, float, bool))}
         
-        # 2. FILTER METADATA: Remove any complex metadata types that ChromaDB can't handle.
-        from langchain_community.vectorstores.utils import filter_complex_metadata
+        collection = self._get_client().get_or_create_collection(
+            name=self.PROFILE_COLLECTION,
+            embedding_function=None
+        )
         
-        # This function will remove any metadata values that are not simple types (str, int, float, bool)
-        filtered_chunks = filter_complex_metadata(chunks)
-        print("   ✅ Filtered out complex metadata values (like lists).")
+        num_chunks = 0
+        num_skipped = 0
+        seen_ids = set()
+        pending = []  # (ids, texts, metadatas, embedding future), in the order chunks were produced
+        deferred = []  # (ids, texts, metadatas) held back until we know whether to use the Batch API
         
-        # 3. Create the vector store from the FILTERED chunks.
-        #    This will automatically generate embeddings for each chunk and store them persistently.
-        self.vectorstore = Chroma.from_documents(
-            documents=filtered_chunks,
-            embedding=self.embeddings,
-            persist_directory=self.persist_directory,
-            ids=[str(uuid.uuid4()) for _ in range(len(filtered_chunks))]
-        )
+        with ThreadPoolExecutor(max_workers=self.EMBEDDING_MAX_WORKERS) as executor:
+            # 2. Split the large profile text into chunks, one batch at a time
+            for batch in _batched(self._chunk_profile_text(profile_text, metadata), self.EMBEDDING_BATCH_SIZE):
+                num_chunks += len(batch)
+                
+                # 3. Give every chunk a content-derived id. Chunks whose id is already stored
+                #    (e.g. re-ingesting an unchanged profile) or repeated are skipped instead of re-embedded.
+                chunks_by_id = {}
+                for chunk in batch:
+                    chunk_id = self._chunk_id(chunk)
+                    if chunk_id not in seen_ids:
+                        seen_ids.add(chunk_id)
+                        chunks_by_id[chunk_id] = chunk
+                existing_ids = set(collection.get(ids=list(chunks_by_id), include=[])["ids"]) if chunks_by_id else set()
+                num_skipped += len(existing_ids)
+                new_chunks = {chunk_id: chunk for chunk_id, chunk in chunks_by_id.items() if chunk_id not in existing_ids}
+                if not new_chunks:
+                    continue
+                
+                ids = list(new_chunks)
+                texts = [chunk.page_content for chunk in new_chunks.values()]
+                metadatas = [chunk.metadata for chunk in new_chunks.values()]
+                if use_async_batch:
+                    deferred.append((ids, texts, metadatas))
+                    continue
+                
+                # 4. Embed the new chunks on a worker thread (cached chunks come from disk),
+                #    up to EMBEDDING_MAX_WORKERS batches in flight at once
+                pending.append((ids, texts, metadatas, executor.submit(self.cached_embeddings.embed_documents, texts)))
+            
+            print(f"   Created {num_chunks} text chunks for vectorization.")
+            print("   ✅ Filtered out complex metadata values (like lists).")
+            if num_skipped:
+                print(f"   ⚡ Skipping {num_skipped} chunk(s) already in the vector store.")
+            
+            if sum(len(ids) for ids, _, _ in deferred) >= self.ASYNC_BATCH_MIN_CHUNKS:
+                # 4b. Large profile: embed everything in one Batch API job and keep the
+                #     results in the embedding cache, like the regular path does
+                ids, texts, metadatas = (list(itertools.chain.from_iterable(column)) for column in zip(*deferred))
+                embeddings = self._embed_with_batch_api(texts, executor)
+                self.cached_embeddings.document_embedding_store.mset(list(zip(texts, embeddings)))
+                self._upsert_embeddings(collection, ids, texts, metadatas, embeddings)
+            else:
+                for ids, texts, metadatas in deferred:
+                    pending.append((ids, texts, metadatas, executor.submit(self.cached_embeddings.embed_documents, texts)))
+            
+            # 5. Upsert the precomputed embeddings in batches straight into the collection,
+            #    so Chroma doesn't embed the chunks again.
+            for ids, texts, metadatas, future in pending:
+                self._upsert_embeddings(collection, ids, texts, metadatas, future.result())
+        
+        # 6. Wrap the same collection in LangChain's Chroma for retrieval
+        self.vectorstore = self._open_collection(self.PROFILE_COLLECTION)
+        self.__dict__.pop("retriever", None)
         
         print(f"   ✅ Vector store created and persisted to '{self.persist_directory}'.")
 
-    def get_retriever(self):
+    @functools.cached_property
+    def retriever(self):
         """
-        Returns a retriever object from the vector store to be used for querying.
-        Must be called after create_and_persist_vectorstore.
+        Retriever over the profile collection, built on first use and reused for every query.
+        Invalidated whenever the store is rebuilt or cleared.
         """
         if self.vectorstore is None:
             # If we're restarting the app, we need to load the existing store from disk.
-            self.vectorstore = Chroma(
-                persist_directory=self.persist_directory,
-                embedding_function=self.embeddings
-            )
+            self.vectorstore = self._open_collection(self.PROFILE_COLLECTION)
         
         # Create a retriever that fetches the top 3 most relevant chunks
         return self.vectorstore.as_retriever(search_kwargs={"k": 3})
 
+    def get_retriever(self):
+        """
+        Returns a retriever object from the vector store to be used for querying.
+        Must be called after create_and_persist_vectorstore.
+        """
+        return self.retriever
+
+    def _get_qa_cache(self) -> Chroma:
+        """
+        Returns the 'qa_cache' collection, opening it on first use.
+        Uses cosine distance so relevance scores are directly comparable to the threshold.
+        """
+        if self.qa_cache is None:
+            self.qa_cache = self._open_collection("qa_cache", {"hnsw:space": "cosine"}, self._get_qa_client())
+        return self.qa_cache
+
+    def lookup_cached_code(self, question: str, schema_hash: str) -> Optional[str]:
+        """
+        Returns the code generated for the most similar previously asked question,
+        or None if nothing above SEMANTIC_CACHE_THRESHOLD exists for this schema.
+        """
+        results = self._get_qa_cache().similarity_search_with_relevance_scores(
+            question,
+            k=1,
+            filter={"schema_hash": schema_hash}
+        )
+        if results:
+            doc, score = results[0]
+            if score >= self.SEMANTIC_CACHE_THRESHOLD:
+                print(f"   ⚡ Semantic cache hit (similarity {score:.3f}): '{doc.page_content}'")
+                return doc.metadata["generated_code"]
+        return None
+
+    def cache_generated_code(self, question: str, generated_code: str, schema_hash: str, result_repr: str) -> None:
+        """
+        Stores a question together with the code that answered it, so paraphrases can reuse it.
+        """
+        self._get_qa_cache().add_texts(
+            texts=[question],
+            metadatas=[{
+                "generated_code": generated_code,
+                "last_result_repr": result_repr[:500],
+                "schema_hash": schema_hash
+            }],
+            ids=[str(uuid.uuid4())]
+        )
+
+    def _release_chroma(self) -> None:
+        """
+        Drops every handle on the persisted profile store and stops Chroma's shared system for it,
+        so its SQLite and HNSW files are closed before they are deleted. The qa_cache stays open.
+        """
+        self.vectorstore = None
+        self.client = None
+        self.__dict__.pop("retriever", None)
+        
+        # Chroma keeps one running system per persist directory for the whole process.
+        # Left running, it holds the old files open, and a new client would reuse its stale state.
+        # The registry is private (and was renamed in chromadb 0.5.3), so this is best-effort.
+        try:
+            systems = getattr(SharedSystemClient, "_identifier_to_system", None)
+            if systems is None:
+                systems = getattr(SharedSystemClient, "_identifer_to_system", {})
+            system = systems.pop(self.persist_directory, None)
+            if system is not None:
+                system.stop()
+        except Exception as e:
+            print(f"   ⚠️ Could not release ChromaDB handles: {e}")
+        gc.collect()
+
+    def _schedule_delete_on_reboot(self) -> bool:
+        """
+        Windows only: asks the OS to delete whatever is still locked at the next reboot.
+        Returns False if that isn't possible (other platforms, or insufficient rights).
+        """
+        if os.name != "nt":
+            return False
+        import ctypes
+        MOVEFILE_DELAY_UNTIL_REBOOT = 0x4
+        move_file = ctypes.windll.kernel32.MoveFileExW
+        # Directories can only be scheduled once empty, so go bottom-up
+        for root, dirs, files in os.walk(self.persist_directory, topdown=False):
+            for name in files + dirs:
+                move_file(os.path.join(root, name), None, MOVEFILE_DELAY_UNTIL_REBOOT)
+        return bool(move_file(self.persist_directory, None, MOVEFILE_DELAY_UNTIL_REBOOT))
+
     def clear_vectorstore(self):
         """
         Deletes the persisted vector store directory.
         Useful for testing or when a new file is uploaded.
         Handles Windows file locking issues with retry logic.
+        Previously answered questions are kept in the separate qa_cache database.
         """
+        # Close our handles first; they are reopened against the fresh directory
+        self._release_chroma()
+
         if not os.path.exists(self.persist_directory):
             print("   ℹ️ No existing vector store found to clear.")
             return
@@ -110,16 +665,14 @@ class DataAnalysisVectorStore:
                 return
             except PermissionError as e:
                 if attempt < max_retries - 1:
-                    wait_time = 1 * (attempt + 1)  # Wait 1s, 2s, 3s, etc.
-                    print(f"   ⏳ File locked (attempt {attempt + 1}/{max_retries}). Waiting {wait_time}s...")
+                    wait_time = 0.1 * 2 ** attempt  # Wait 0.1s, 0.2s, 0.4s, 0.8s
+                    print(f"   ⏳ File locked (attempt {attempt + 1}/{max_retries}). Waiting {wait_time:.1f}s...")
                     time.sleep(wait_time)
                 else:
                     print(f"   ❌ Failed to clear vector store after {max_retries} attempts: {e}")
-                    # Try a more forceful approach on final attempt
-                    try:
-                        os.system(f'rmdir /s /q "{self.persist_directory}"')
-                        print("   ✅ Vector store cleared using force method.")
-                    except:
+                    if self._schedule_delete_on_reboot():
+                        print("   ⏳ Locked files will be deleted on the next reboot.")
+                    else:
                         print("   ❌ Could not clear vector store. Manual cleanup may be required.")
             except Exception as e:
                 print(f"   ❌ Error clearing vector store: {e}")